@@ -1,41 +1,209 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 from flask_cors import CORS  # <-- enable CORS
 from datetime import datetime
+from hashlib import blake2b
+from collections import Counter, OrderedDict
+import gzip
+import heapq
 import io
+import os
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A3, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus.doctemplate import LayoutError
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, HRFlowable
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.units import inch
 import random
+import sys
+import threading
+import time
+import weakref
+from tempfile import SpooledTemporaryFile
+from xml.sax.saxutils import escape
+from dataclasses import dataclass, field
 
 # ------------------------
 # Flask App Setup
 # ------------------------
 app = Flask(__name__)
 CORS(app)
+# Responses echo whole timetables; skip key sorting when serializing them
+app.json.sort_keys = False
 
-# In-memory storage
-timetables = {}
+class SessionStore(OrderedDict):
+    """In-process dict whose entries expire `ttl` seconds after last use, holding at most `max_items`.
+
+    Least recently used entries are dropped first once the store is full, so abandoned sessions
+    don't pile up for the life of the process. With `max_bytes`, values must be bytes-like and
+    their combined length is capped as well.
+    """
+
+    def __init__(self, ttl, max_items, max_bytes=None):
+        super().__init__()
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.expires = {}
+        self.sizes = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def _drop(self, key):
+        # Caller holds the lock
+        super().__delitem__(key)
+        del self.expires[key]
+        self.total_bytes -= self.sizes.pop(key, 0)
+
+    def _live(self, key, now):
+        # Caller holds the lock; drops `key` if it has expired
+        if key in self.expires and self.expires[key] <= now:
+            self._drop(key)
+        return OrderedDict.__contains__(self, key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._live(key, time.monotonic())
+
+    def __getitem__(self, key):
+        with self.lock:
+            now = time.monotonic()
+            if not self._live(key, now):
+                raise KeyError(key)
+            self.move_to_end(key)
+            self.expires[key] = now + self.ttl
+            return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _purge_expired(self, now):
+        # Caller holds the lock. Entries are kept in last-use order and share one TTL,
+        # so expired ones are exactly those at the front.
+        while self:
+            oldest = next(iter(self))
+            if self.expires[oldest] > now:
+                break
+            self._drop(oldest)
+
+    def _over_budget(self):
+        return len(self) > self.max_items or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            now = time.monotonic()
+            self._purge_expired(now)
+            if OrderedDict.__contains__(self, key):
+                self._drop(key)
+            super().__setitem__(key, value)
+            self.expires[key] = now + self.ttl
+            if self.max_bytes is not None:
+                self.sizes[key] = len(value)
+                self.total_bytes += len(value)
+            while self and self._over_budget():
+                self._drop(next(iter(self)))
+
+    def __delitem__(self, key):
+        with self.lock:
+            self._drop(key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            if OrderedDict.__contains__(self, key):
+                value = super().__getitem__(key)
+                self._drop(key)
+                return value
+            return super().pop(key, *default)
+
+
+# In-memory storage, bounded so abandoned sessions are eventually released
+SESSION_TTL = int(os.environ.get('SESSION_TTL_SECONDS', 3600))
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 500))
+timetables = SessionStore(SESSION_TTL, MAX_SESSIONS)
 # Short-term session memory: keyed by session_id, resets with process
-session_memory = {}
+session_memory = SessionStore(SESSION_TTL, MAX_SESSIONS)
+# Rendered Excel exports: (session_id, 'excel') -> (timetable fingerprint, file bytes)
+export_cache = SessionStore(SESSION_TTL, MAX_SESSIONS)
+# Rendered PDFs by content digest, shared across sessions that render the same timetable;
+# capped by total size, and a single build may take at most PDF_CACHE_MAX_ENTRY_BYTES of it
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PDF_CACHE_MAX_ENTRY_BYTES = PDF_CACHE_MAX_BYTES // 8
+pdf_cache = SessionStore(SESSION_TTL, MAX_SESSIONS, max_bytes=PDF_CACHE_MAX_BYTES)
+
+
+class SharedList(list):
+    """Plain list that can be weakly referenced (built-in lists can't)"""
+    __slots__ = ('__weakref__',)
+
+
+# Canonical copies of day/slot/classroom lists, shared by every session with the same config;
+# an entry disappears once no stored session refers to its list any more
+shared_lists = weakref.WeakValueDictionary()
+
+def share_list(values):
+    """Return the shared list equal to `values`, with its strings interned"""
+    try:
+        key = tuple(values)
+        shared = shared_lists.get(key)
+    except TypeError:
+        return values  # unhashable items: keep the caller's list
+    if shared is None:
+        shared = SharedList(sys.intern(v) if isinstance(v, str) else v for v in values)
+        shared_lists[key] = shared
+    return shared
+
+@dataclass(slots=True)
+class Entry:
+    """One scheduled session; serialized to the unified JSON entry format by jsonify"""
+    day: str
+    time_slot: str
+    subject: str
+    teacher: str
+    semester: str
+    classrooms: list = field(default_factory=list)
+    department_codes: list = field(default_factory=list)
+    description: str | None = None
 
 class TimetableGenerator:
     def __init__(self, teachers, subjects, classrooms, time_slots, days, semesters):
         self.teachers = teachers
         self.subjects = subjects
         self.classrooms = classrooms
-        self.time_slots = time_slots
-        self.days = days
+        # Repeated days/slots name the same cell; drop repeats so bit indices stay dense
+        self.time_slots = time_slots = list(dict.fromkeys(time_slots))
+        self.days = days = list(dict.fromkeys(days))
         self.semesters = semesters
         self.timetable = []
         self.conflicts = []
-        
 
-        
+        # Position of each day/slot in the configured ordering (O(1) instead of list.index)
+        self.day_rank = {day: d for d, day in enumerate(days)}
+        self.slot_rank = {slot: s for s, slot in enumerate(time_slots)}
+        # Bit position of each (day, slot) so per-resource occupancy fits in a single int
+        n_slots = len(time_slots)
+        self.slot_index = {
+            (day, slot): self.day_rank[day] * n_slots + self.slot_rank[slot]
+            for day in days
+            for slot in time_slots
+        }
+        self.n_cells = len(days) * n_slots
+        # Availability bitmask per teacher: bit set iff the teacher can teach at that (day, slot)
+        self.teacher_avail_mask = {}
+        for teacher in teachers:
+            mask = 0
+            for (day, slot), idx in self.slot_index.items():
+                if self.is_teacher_available(teacher, day, slot):
+                    mask |= 1 << idx
+            self.teacher_avail_mask[teacher['name']] = mask
+
     def _subject_color(self, name: str) -> str:
         # Deterministic HSL pastel color from subject name
         h = 0
@@ -45,7 +213,9 @@ class TimetableGenerator:
 
     def _rank_slots(self, cohort_load, day, slot, cohort):
         # Lower score is better
-        day_load = cohort_load.get(cohort, {}).get(day, 0)
+        # cohort_load holds one counter per day, indexed by day rank
+        loads = cohort_load.get(cohort)
+        day_load = loads[self.day_rank[day]] if loads else 0
         # prefer days with lower load and contiguous slots within a day
         contiguous_bonus = 0
         # in absence of exact time order semantics, no adjacency detection beyond load
@@ -70,34 +240,28 @@ class TimetableGenerator:
         days_order = list(self.days)
         slots_order = list(self.time_slots)
 
-        # Initialize schedules for tracking
-        teacher_schedule = {
-            teacher['name']: {day: {slot: False for slot in slots_order} for day in days_order}
-            for teacher in self.teachers
-        }
-        classroom_schedule = {
-            classroom: {day: {slot: False for slot in slots_order} for day in days_order}
-            for classroom in self.classrooms
-        }
-        # cohort schedule by semester
-        cohort_schedule = {
-            semester: {day: {slot: False for slot in slots_order} for day in days_order}
-            for semester in (set([s.get('semester', 'General') for s in self.subjects]) or {'General'})
-        }
-        # cohort daily load counts
-        cohort_load = {}
+        semester_set = set([s.get('semester', 'General') for s in self.subjects]) or {'General'}
+        # cohort daily load counts, one counter per day indexed by day rank
+        cohort_load = {semester: [0] * len(days_order) for semester in semester_set}
+        # total sessions placed per teacher (only changes when a session is placed or moved)
+        teacher_total_load = {t['name']: 0 for t in self.teachers}
+        # Schedules for tracking: one int per teacher/classroom/cohort, bit slot_index[(day, slot)]
+        # set while that (day, slot) is booked
+        slot_index = self.slot_index
+        day_rank, slot_rank = self.day_rank, self.slot_rank
+        teacher_avail_mask = self.teacher_avail_mask
+        teacher_busy_mask = {t['name']: 0 for t in self.teachers}
+        classroom_busy_mask = {c: 0 for c in self.classrooms}
+        cohort_busy_mask = {semester: 0 for semester in semester_set}
+        # (semester, slot index) -> (entry, subject) holding that cohort slot, for repairs
+        cohort_owner = {}
 
         def can_place(subject, teacher, classroom, day, slot):
-            semester = subject.get('semester', 'General')
-            if teacher_schedule.get(teacher['name'], {}).get(day, {}).get(slot):
-                return False
-            if classroom_schedule.get(classroom, {}).get(day, {}).get(slot):
-                return False
-            if cohort_schedule.get(semester, {}).get(day, {}).get(slot):
-                return False
-            if not self.is_teacher_available(teacher, day, slot):
-                return False
-            return True
+            idx = slot_index[(day, slot)]
+            busy = (teacher_busy_mask.get(teacher['name'], 0)
+                    | classroom_busy_mask.get(classroom, 0)
+                    | cohort_busy_mask.get(subject.get('semester', 'General'), 0))
+            return ((busy >> idx) & 1) == 0 and ((teacher_avail_mask.get(teacher['name'], 0) >> idx) & 1) == 1
 
         def extract_all_dept_codes(subject):
             try:
@@ -131,65 +295,252 @@ class TimetableGenerator:
 
         def place_entry(subject, teacher, classroom, day, slot):
             semester = subject.get('semester', 'General')
-            entry = {
-                'day': day,
-                'time_slot': slot,
-                'subject': subject['name'],
-                'teacher': teacher['name'],
-                'semester': semester,
-                'classrooms': [classroom],
-                'department_codes': extract_all_dept_codes(subject)
-            }
+            entry = Entry(
+                day=day,
+                time_slot=slot,
+                subject=subject['name'],
+                teacher=teacher['name'],
+                semester=semester,
+                classrooms=[classroom],
+                department_codes=list(self._dept_cache[id(subject)]),
+                description=None
+            )
             self.timetable.append(entry)
-            teacher_schedule[teacher['name']][day][slot] = True
-            classroom_schedule[classroom][day][slot] = True
-            cohort_schedule[semester][day][slot] = True
-            cohort_load.setdefault(semester, {}).setdefault(day, 0)
-            cohort_load[semester][day] += 1
+            book_entry(entry, subject)
+
+        def book_entry(entry, subject):
+            day, slot = entry.day, entry.time_slot
+            teacher, classroom, semester = entry.teacher, entry.classrooms[0], entry.semester
+            teacher_total_load[teacher] += 1
+            idx = slot_index[(day, slot)]
+            bit = 1 << idx
+            teacher_busy_mask[teacher] |= bit
+            classroom_busy_mask[classroom] |= bit
+            cohort_busy_mask[semester] |= bit
+            cohort_owner[(semester, idx)] = (entry, subject)
+            cohort_load[semester][day_rank[day]] += 1
+
+        def unbook_entry(entry):
+            day, slot = entry.day, entry.time_slot
+            teacher, classroom, semester = entry.teacher, entry.classrooms[0], entry.semester
+            teacher_total_load[teacher] -= 1
+            idx = slot_index[(day, slot)]
+            bit = 1 << idx
+            teacher_busy_mask[teacher] &= ~bit
+            classroom_busy_mask[classroom] &= ~bit
+            cohort_busy_mask[semester] &= ~bit
+            cohort_owner.pop((semester, idx), None)
+            cohort_load[semester][day_rank[day]] -= 1
+
+        def move_entry(entry, subject, teacher, classroom, day, slot):
+            unbook_entry(entry)
+            entry.day, entry.time_slot = day, slot
+            entry.teacher, entry.classrooms = teacher['name'], [classroom]
+            book_entry(entry, subject)
+
+        # Slot ranking only depends on the cohort's per-day loads, so reuse it per load profile
+        ranked_by_loads = {}
 
         def rank_slots_for_semester(semester):
+            loads = cohort_load[semester]
+            profile = tuple(loads)
+            cached = ranked_by_loads.get(profile)
+            if cached is not None:
+                return cached
             ranked = []
             for day in days_order:
-                load = cohort_load.get(semester, {}).get(day, 0)
+                load = loads[day_rank[day]]
+                # score only depends on the day's load, so compute it once per day
+                score = self._rank_slots(cohort_load, day, None, semester)
                 for slot in slots_order:
-                    score = self._rank_slots(cohort_load, day, slot, semester)
                     # include load primarily to spread out
                     ranked.append((score + load * 10, day, slot))
-            ranked.sort(key=lambda x: (x[0], days_order.index(x[1]), slots_order.index(x[2])))
-            return [(day, slot) for _, day, slot in ranked]
+            ranked.sort(key=lambda x: (x[0], day_rank[x[1]], slot_rank[x[2]]))
+            ranked_by_loads[profile] = [(day, slot) for _, day, slot in ranked]
+            return ranked_by_loads[profile]
+
+        all_slots_mask = (1 << self.n_cells) - 1
+
+        def free_teacher_mask(teachers_for_subject):
+            """Slots where at least one of the given teachers is available and not yet booked."""
+            mask = 0
+            for t in teachers_for_subject:
+                mask |= teacher_avail_mask.get(t['name'], 0) & ~teacher_busy_mask.get(t['name'], 0)
+            return mask & all_slots_mask
+
+        def free_classroom_mask():
+            """Slots where at least one classroom is still free."""
+            mask = 0
+            for c in self.classrooms:
+                mask |= ~classroom_busy_mask[c] & all_slots_mask
+                if mask == all_slots_mask:
+                    break
+            return mask
+
+        # (day, slot) for each bit position; indices are dense over the de-duplicated days/slots
+        slot_at = [None] * self.n_cells
+        for pos, idx in slot_index.items():
+            slot_at[idx] = pos
+
+        def slots_in_mask(mask, limit):
+            """First `limit` (day, slot) pairs whose bit is set, in day/slot order."""
+            found = []
+            mask &= all_slots_mask
+            while mask and len(found) < limit:
+                low = mask & -mask
+                found.append(slot_at[low.bit_length() - 1])
+                mask ^= low
+            return found
+
+        def feasible_slot_mask(subject, teachers_for_subject):
+            """Slots with a free teacher, a free classroom and a free cohort for this subject."""
+            cohort_busy = cohort_busy_mask.get(subject.get('semester', 'General'), 0)
+            return free_teacher_mask(teachers_for_subject) & free_classroom_mask() & ~cohort_busy
 
         def all_candidate_assignments(subject):
-            """Yield deterministic feasible combos (day, slot, teacher, classroom) sorted by rank."""
+            """Yield deterministic feasible combos (day, slot, teacher, classroom), best first.
+
+            Candidates are popped lazily from a heap keyed on (teacher load, day, slot, teacher,
+            classroom), so callers that stop after a few placements never order the rest. A candidate
+            whose teacher picked up sessions since it was pushed is re-pushed with the fresh load.
+            """
             semester = subject.get('semester', 'General')
             subject_key = (subject.get('name') or '').strip().lower()
             teachers_for_subject = subject_to_teachers.get(subject_key, [])
             if not teachers_for_subject:
-                return []
-            candidates = []
+                return
+            feasible_mask = feasible_slot_mask(subject, teachers_for_subject)
+            if not feasible_mask:
+                return
+            heap = []
             for day, slot in rank_slots_for_semester(semester):
+                idx = slot_index[(day, slot)]
+                if not (feasible_mask >> idx) & 1:
+                    continue
                 for t in teachers_for_subject:
-                    if not self.is_teacher_available(t, day, slot):
+                    name = t['name']
+                    if not ((teacher_avail_mask[name] & ~teacher_busy_mask[name]) >> idx) & 1:
                         continue
+                    # prioritize balanced teacher load: fewer total slots scheduled earlier
+                    t_load = teacher_total_load.get(name, 0)
                     for c in self.classrooms:
-                        if can_place(subject, t, c, day, slot):
-                            # prioritize balanced teacher load: fewer total slots scheduled earlier
-                            t_load = sum(1 for d in days_order for s in slots_order if teacher_schedule[t['name']][d][s])
-                            candidates.append((t_load, days_order.index(day), slots_order.index(slot), day, slot, t, c))
-            candidates.sort(key=lambda x: (x[0], x[1], x[2], (x[5]['name']).lower(), x[6]))
-            return [(day, slot, t, c) for _, _, _, day, slot, t, c in candidates]
+                        if not (classroom_busy_mask[c] >> idx) & 1:
+                            # len(heap) breaks ties before the (unorderable) teacher dict is compared
+                            heap.append((t_load, day_rank[day], slot_rank[slot], name.lower(), c, len(heap), day, slot, t))
+            heapq.heapify(heap)
+            while heap:
+                item = heapq.heappop(heap)
+                t_load = teacher_total_load.get(item[8]['name'], 0)
+                if t_load != item[0]:
+                    heapq.heappush(heap, (t_load,) + item[1:])
+                    continue
+                yield item[6], item[7], item[8], item[4]
+
+        def freed_resources(entry, teachers, bit):
+            """Teachers and classrooms usable at slot `bit` once `entry` has left it."""
+            free_teachers = [
+                t for t in teachers
+                if teacher_avail_mask[t['name']] & bit
+                and (t['name'] == entry.teacher or not teacher_busy_mask[t['name']] & bit)
+            ]
+            free_classes = [
+                c for c in self.classrooms
+                if c == entry.classrooms[0] or not classroom_busy_mask[c] & bit
+            ]
+            return free_teachers, free_classes
+
+        def least_loaded(teachers):
+            return min(teachers, key=lambda t: (teacher_total_load[t['name']], t['name'].lower()))
+
+        # Longest chain of sessions moved to free one cohort slot
+        max_repair_depth = 3
+
+        def vacate(semester, idx, visited, depth, failed):
+            """Move the cohort session holding slot `idx` elsewhere.
+
+            The session goes to a free slot of its own if there is one; otherwise to a slot held by
+            another session of the cohort, which is vacated the same way (at most `depth` more moves,
+            never revisiting a slot in `visited`). Nothing changes unless True is returned.
+            `failed` maps slots already searched without success in this repair to the deepest
+            depth tried; they are only searched again with more depth left.
+            """
+            key = (semester, idx)
+            if failed.get(key, -1) >= depth:
+                return False
+            entry, other = cohort_owner[(semester, idx)]
+            target = next(iter(all_candidate_assignments(other)), None)
+            if target is not None:
+                move_entry(entry, other, target[2], target[3], target[0], target[1])
+                return True
+            if depth == 0:
+                failed[key] = max(failed.get(key, -1), depth)
+                return False
+            other_key = (other.get('name') or '').strip().lower()
+            teachers_for_other = subject_to_teachers.get(other_key, [])
+            for day, slot in rank_slots_for_semester(semester):
+                y = slot_index[(day, slot)]
+                if y in visited or (semester, y) not in cohort_owner:
+                    continue
+                visited.add(y)
+                free_teachers, free_classes = freed_resources(cohort_owner[(semester, y)][0], teachers_for_other, 1 << y)
+                if free_teachers and free_classes and vacate(semester, y, visited, depth - 1, failed):
+                    move_entry(entry, other, least_loaded(free_teachers), min(free_classes), day, slot)
+                    return True
+            failed[key] = max(failed.get(key, -1), depth)
+            return False
+
+        def augment(subject):
+            """Place one more session of `subject` by moving sessions of its cohort out of the way.
+
+            Each cohort can hold one session per (day, slot), so placing sessions is a matching
+            between sessions and slots. When the greedy passes leave `subject` short, look for a
+            slot that only fails because another subject of the same cohort sits there, shift that
+            session (and, if needed, a short chain of others) along an augmenting path and take the
+            vacated slot. Returns True if a session was placed.
+            """
+            semester = subject.get('semester', 'General')
+            subject_key = (subject.get('name') or '').strip().lower()
+            teachers_for_subject = subject_to_teachers.get(subject_key, [])
+            if not teachers_for_subject:
+                return False
+            # Every chain ends by moving a session into a slot the cohort doesn't use yet,
+            # which needs a free classroom there; without one no chain can succeed
+            if not free_classroom_mask() & ~cohort_busy_mask[semester]:
+                return False
+            failed = {}
+            for day, slot in rank_slots_for_semester(semester):
+                idx = slot_index[(day, slot)]
+                owner = cohort_owner.get((semester, idx))
+                if owner is None or owner[1] is subject:
+                    continue
+                # resources usable here once the current session has vacated the slot
+                free_teachers, free_classes = freed_resources(owner[0], teachers_for_subject, 1 << idx)
+                if not free_teachers or not free_classes:
+                    continue
+                if not vacate(semester, idx, {idx}, max_repair_depth - 1, failed):
+                    continue
+                place_entry(subject, least_loaded(free_teachers), min(free_classes), day, slot)
+                return True
+            return False
+
+        # Department codes only depend on the subject, so parse them once per subject
+        self._dept_cache = {id(s): extract_all_dept_codes(s) for s in self.subjects}
 
         # Assign classes per subject exhaustively
+        shortfalls = []  # (subject, sessions_required, placed) for subjects left short
         for subject in self.subjects:
             sessions_required = int(subject.get('sessions_per_week', 2) or 0)
             placed = 0
-            # Enumerate all feasible assignments once
-            feasible = all_candidate_assignments(subject)
+            subject_key = (subject.get('name') or '').strip().lower()
+            teachers_for_subject = subject_to_teachers.get(subject_key, [])
             used_positions = set()  # (day, slot) used by this subject to spread across days
             used_days = set()       # days already used for this subject to encourage spread
-            feasible_days = set(d for (d, _s, _t, _c) in feasible)
+            feasible_days = set(
+                day for day, _slot in slots_in_mask(feasible_slot_mask(subject, teachers_for_subject), len(slot_at))
+            )
 
             # Greedy deterministic placement favoring spread and low teacher load
-            for (day, slot, teacher, classroom) in feasible:
+            for (day, slot, teacher, classroom) in all_candidate_assignments(subject):
                 if placed >= sessions_required:
                     break
                 # Avoid multiple sessions of same subject in same (day, slot)
@@ -207,13 +558,24 @@ class TimetableGenerator:
 
             # If still missing, allow same (day, slot) but try different teachers/classrooms
             if placed < sessions_required:
-                for (day, slot, teacher, classroom) in feasible:
+                for (day, slot, teacher, classroom) in all_candidate_assignments(subject):
                     if placed >= sessions_required:
                         break
                     if can_place(subject, teacher, classroom, day, slot):
                         place_entry(subject, teacher, classroom, day, slot)
                         placed += 1
 
+            if placed < sessions_required:
+                shortfalls.append((subject, sessions_required, placed))
+
+        # Repair pass once every subject had its greedy turn: relocate other sessions of the
+        # cohort to make room, so a short subject cannot starve subjects that come after it
+        for i, (subject, sessions_required, placed) in enumerate(shortfalls):
+            while placed < sessions_required and augment(subject):
+                placed += 1
+            shortfalls[i] = (subject, sessions_required, placed)
+
+        for subject, sessions_required, placed in shortfalls:
             # Record conflicts with deterministic suggestions if any sessions couldn't be placed
             if placed < sessions_required:
                 missing = sessions_required - placed
@@ -222,43 +584,29 @@ class TimetableGenerator:
                 reasons = []
                 subject_key = (subject.get('name') or '').strip().lower()
                 teachers_for_subject = subject_to_teachers.get(subject_key, [])
+                semester = subject.get('semester', 'General')
+                teacher_free = free_teacher_mask(teachers_for_subject)
+                class_free = free_classroom_mask()
+                cohort_busy = cohort_busy_mask.get(semester, 0)
                 if not teachers_for_subject:
                     reasons.append('No teacher associated with subject')
                 else:
-                    # For each day/slot, check why not placeable
-                    for day in days_order:
-                        for slot in slots_order:
-                            any_teacher_free = any(self.is_teacher_available(t, day, slot) and not teacher_schedule[t['name']][day][slot]
-                                                   for t in teachers_for_subject)
-                            any_class_free = any(not classroom_schedule[c][day][slot] for c in self.classrooms)
-                            semester = subject.get('semester', 'General')
-                            cohort_busy = cohort_schedule[semester][day][slot]
-                            if not any_teacher_free:
-                                reasons.append(f"No available teacher at {day} {slot}")
-                            if not any_class_free:
-                                reasons.append(f"No available classroom at {day} {slot}")
-                            if cohort_busy:
-                                reasons.append(f"Semester busy at {day} {slot}")
-                    # Deduplicate reasons
-                    seen = set()
-                    reasons = [r for r in reasons if not (r in seen or seen.add(r))]
+                    # One summary per category, or at most a few example slots where it blocks
+                    for blocked, label in (
+                        (~teacher_free & all_slots_mask, 'No available teacher'),
+                        (~class_free & all_slots_mask, 'No available classroom'),
+                        (cohort_busy, 'Semester busy'),
+                    ):
+                        if blocked == all_slots_mask:
+                            reasons.append(f"{label} at any slot")
+                        else:
+                            reasons.extend(f"{label} at {day} {slot}" for day, slot in slots_in_mask(blocked, 5))
 
                 # Suggestions (top few free positions regardless of teacher)
-                suggestions = []
-                for day in days_order:
-                    for slot in slots_order:
-                        semester = subject.get('semester', 'General')
-                        if cohort_schedule[semester][day][slot]:
-                            continue
-                        # gather teachers and classrooms free
-                        free_teachers = [t for t in teachers_for_subject if self.is_teacher_available(t, day, slot) and not teacher_schedule[t['name']][day][slot]]
-                        free_classes = [c for c in self.classrooms if not classroom_schedule[c][day][slot]]
-                        if free_teachers and free_classes:
-                            suggestions.append(f"{day} @ {slot}")
-                        if len(suggestions) >= 5:
-                            break
-                    if len(suggestions) >= 5:
-                        break
+                suggestions = [
+                    f"{day} @ {slot}"
+                    for day, slot in slots_in_mask(teacher_free & class_free & ~cohort_busy, 5)
+                ]
 
                 self.conflicts.append({
                     'type': 'student',
@@ -277,7 +625,7 @@ class TimetableGenerator:
         # Post-generation validation: ensure each subject appears required number of times
         occurrences = {}
         for e in self.timetable:
-            occurrences[(e['subject'], e.get('semester', 'General'))] = occurrences.get((e['subject'], e.get('semester', 'General')), 0) + 1
+            occurrences[(e.subject, e.semester)] = occurrences.get((e.subject, e.semester), 0) + 1
         for subject in self.subjects:
             sessions_required = int(subject.get('sessions_per_week', 2) or 0)
             key = (subject['name'], subject.get('semester', 'General'))
@@ -313,43 +661,89 @@ class TimetableGenerator:
     
     def detect_conflicts(self):
         """Detect scheduling conflicts across teacher/classroom/student and attach suggestions"""
+        self.by_slot = self.group_by_slot(self.timetable)
+        # Occurrence counts per (resource, day, slot); only keys counted twice need subject lists.
+        # Counter() over a generator does the counting in C, unlike repeated index_entry calls.
+        tt = self.timetable
+        self.indices = {
+            'teacher': Counter((e.teacher, e.day, e.time_slot) for e in tt),
+            'classroom': Counter((c, e.day, e.time_slot) for e in tt for c in e.classrooms),
+            'cohort': Counter((e.semester, e.day, e.time_slot) for e in tt),
+        }
+        clashing = set()
+        for counter in self.indices.values():
+            clashing.update((day, slot) for (_name, day, slot), n in counter.items() if n > 1)
+        self.slot_conflicts = {}
         conflicts = []
-        indexed = {}
-        for e in self.timetable:
-            key = (e['day'], e['time_slot'])
-            indexed.setdefault(key, []).append(e)
-
-        for (day, slot), entries in indexed.items():
-            # teacher conflicts
-            teacher_map = {}
-            classroom_map = {}
-            cohort_map = {}
-            for e in entries:
-                teacher_map.setdefault(e['teacher'], []).append(e)
-                # explode classrooms list for conflict detection per room
-                for c in (e.get('classrooms') or []):
-                    classroom_map.setdefault(c, []).append(e)
-                cohort_map.setdefault(e.get('semester','General'), []).append(e)
-            for t, arr in teacher_map.items():
-                if len(arr) > 1:
-                    conflicts.append({
-                        'type': 'teacher', 'teacher': t, 'day': day, 'time_slot': slot,
-                        'subjects': [x['subject'] for x in arr]
-                    })
-            for c, arr in classroom_map.items():
-                if len(arr) > 1:
-                    conflicts.append({
-                        'type': 'classroom', 'classroom': c, 'day': day, 'time_slot': slot,
-                        'subjects': [x['subject'] for x in arr]
-                    })
-            for cohort, arr in cohort_map.items():
-                if len(arr) > 1:
-                    conflicts.append({
-                        'type': 'student', 'semester': cohort, 'day': day, 'time_slot': slot,
-                        'subjects': [x['subject'] for x in arr]
-                    })
+        for (day, slot), entries in self.by_slot.items():
+            if (day, slot) in clashing:
+                found = self.conflicts_at(day, slot, entries, self.indices)
+                self.slot_conflicts[(day, slot)] = found
+                conflicts.extend(found)
         self.conflicts.extend(conflicts)
 
+    @staticmethod
+    def entry_key(e):
+        """Hashable identity of an entry as far as conflict detection is concerned"""
+        return (e.day, e.time_slot, e.subject, e.teacher, e.semester, tuple(e.classrooms))
+
+    @staticmethod
+    def group_by_slot(timetable):
+        """Map (day, slot) -> entries in that cell, preserving timetable order"""
+        by_slot = {}
+        for e in timetable:
+            by_slot.setdefault((e.day, e.time_slot), []).append(e)
+        return by_slot
+
+    @staticmethod
+    def index_entry(indices, e, delta):
+        """Add (delta=1) or remove (delta=-1) an entry's teacher/classroom/cohort occurrence counts"""
+        keys = [('teacher', e.teacher), ('cohort', e.semester)]
+        # explode classrooms list for conflict detection per room
+        keys += [('classroom', c) for c in e.classrooms]
+        for kind, name in keys:
+            counter = indices[kind]
+            key = (name, e.day, e.time_slot)
+            counter[key] += delta
+            if counter[key] <= 0:
+                del counter[key]
+
+    @staticmethod
+    def cell_key_sequences(timetable, keys):
+        """Map (day, slot) -> entry keys in that cell, in timetable order"""
+        cells = {}
+        for e, k in zip(timetable, keys):
+            cells.setdefault((e.day, e.time_slot), []).append(k)
+        return cells
+
+    @staticmethod
+    def conflicts_at(day, slot, entries, indices):
+        """Conflicts within a single (day, slot) given the entries in that cell"""
+        by_kind = {'teacher': {}, 'classroom': {}, 'cohort': {}}
+        for e in entries:
+            keys = [('teacher', e.teacher), ('cohort', e.semester)]
+            keys += [('classroom', c) for c in e.classrooms]
+            for kind, name in keys:
+                if indices[kind][(name, day, slot)] > 1:
+                    by_kind[kind].setdefault(name, []).append(e.subject)
+        conflicts = []
+        for t, subjects in by_kind['teacher'].items():
+            conflicts.append({
+                'type': 'teacher', 'teacher': t, 'day': day, 'time_slot': slot,
+                'subjects': subjects
+            })
+        for c, subjects in by_kind['classroom'].items():
+            conflicts.append({
+                'type': 'classroom', 'classroom': c, 'day': day, 'time_slot': slot,
+                'subjects': subjects
+            })
+        for cohort, subjects in by_kind['cohort'].items():
+            conflicts.append({
+                'type': 'student', 'semester': cohort, 'day': day, 'time_slot': slot,
+                'subjects': subjects
+            })
+        return conflicts
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -357,7 +751,7 @@ def index():
 @app.route('/generate', methods=['POST'])
 def generate_timetable():
     try:
-        data = request.json
+        data = request.get_json(cache=False)
         # Optional existing session_id to continue a session
         existing_session_id = data.get('session_id')
         
@@ -374,6 +768,10 @@ def generate_timetable():
         
         if not all([teachers, subjects, classrooms, time_slots, days]):
             return jsonify({'error': 'Missing required data'}), 400
+
+        classrooms = share_list(classrooms)
+        time_slots = share_list(time_slots)
+        days = share_list(days)
         
         generator = TimetableGenerator(teachers, subjects, classrooms, time_slots, days, semesters)
         result = generator.generate()
@@ -381,9 +779,16 @@ def generate_timetable():
         # Decide session_id: reuse if provided, else create new
         import secrets
         session_id = existing_session_id or secrets.token_hex(8)
+        invalidate_exports(session_id)
         timetables[session_id] = {
             'timetable': result['timetable'],
             'conflicts': result['conflicts'],
+            # per-(day, slot) buckets and conflicts so edits only re-check the cells they touch
+            'indices': generator.indices,
+            'slot_conflicts': generator.slot_conflicts,
+            'by_slot': generator.by_slot,
+            # serializes /update-timetable edits against the indices above
+            'lock': threading.Lock(),
             'metadata': {
                 'classrooms': classrooms,
                 'days': days,
@@ -403,25 +808,12 @@ def generate_timetable():
             'preferences': preferences,
             'last_updated': datetime.now().isoformat()
         }
-        
-        # Normalize timetable entries to unified format
-        def normalize_entry(e):
-            return {
-                'day': e.get('day'),
-                'time_slot': e.get('time_slot'),
-                'subject': e.get('subject'),
-                'teacher': e.get('teacher'),
-                'semester': e.get('semester'),
-                'classrooms': e.get('classrooms') if isinstance(e.get('classrooms'), list) and e.get('classrooms') else ([e.get('classroom')] if e.get('classroom') else []),
-                'department_codes': e.get('department_codes') if isinstance(e.get('department_codes'), list) else ([] if e.get('department_codes') is None else [e.get('department_codes')]),
-                'description': e.get('description')
-            }
-        normalized_tt = [normalize_entry(e) for e in result['timetable']]
 
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'timetable': normalized_tt,
+            # place_entry already emits entries in the unified format
+            'timetable': result['timetable'],
             'conflicts': result['conflicts'],
             'memory': session_memory[session_id]
         })
@@ -435,7 +827,7 @@ def generate_timetable():
 @app.route('/update-timetable', methods=['POST'])
 def update_timetable():
     try:
-        data = request.json
+        data = request.get_json(cache=False)
         session_id = data.get('session_id')
         timetable = data.get('timetable')
         # Optional updates to memory fields to let user modify previous inputs
@@ -449,26 +841,67 @@ def update_timetable():
             dept = e.get('department_codes')
             if not isinstance(dept, list):
                 dept = ([] if dept is None else [dept])
-            return {
-                'day': e.get('day'),
-                'time_slot': e.get('time_slot'),
-                'subject': e.get('subject'),
-                'teacher': e.get('teacher'),
-                'semester': e.get('semester'),
-                'classrooms': classrooms,
-                'department_codes': dept,
-                'description': e.get('description')
-            }
+            return Entry(
+                day=e.get('day'),
+                time_slot=e.get('time_slot'),
+                subject=e.get('subject'),
+                teacher=e.get('teacher'),
+                semester=e.get('semester'),
+                classrooms=classrooms,
+                department_codes=dept,
+                description=e.get('description')
+            )
         normalized_tt = [normalize_entry(e) for e in (timetable or [])]
         
-        if session_id in timetables:
-            timetables[session_id]['timetable'] = normalized_tt
-            
-            # Re-detect conflicts
-            generator = TimetableGenerator([], [], [], [], [], [])
-            generator.timetable = normalized_tt
-            generator.detect_conflicts()
-            timetables[session_id]['conflicts'] = generator.conflicts
+        stored = timetables.get(session_id)
+        if stored is not None:
+            # Concurrent edits to one session must apply their diffs to the shared indices one at a time
+            with stored['lock']:
+                invalidate_exports(session_id)
+                indices = stored.get('indices')
+                slot_conflicts = stored.get('slot_conflicts')
+                if indices is None or slot_conflicts is None:
+                    # Re-detect conflicts from scratch
+                    generator = TimetableGenerator([], [], [], [], [], [])
+                    generator.timetable = normalized_tt
+                    generator.detect_conflicts()
+                    stored['indices'] = generator.indices
+                    stored['slot_conflicts'] = slot_conflicts = generator.slot_conflicts
+                    by_slot = generator.by_slot
+                else:
+                    # Apply only the diff between the stored and incoming entries
+                    by_slot = TimetableGenerator.group_by_slot(normalized_tt)
+                    # Key every entry once; the same keys drive both the multiset diff and the walk below
+                    old_tt = stored['timetable']
+                    old_keys = list(map(TimetableGenerator.entry_key, old_tt))
+                    new_keys = list(map(TimetableGenerator.entry_key, normalized_tt))
+                    old_counts = Counter(old_keys)
+                    new_counts = Counter(new_keys)
+                    removed = old_counts - new_counts
+                    added = new_counts - old_counts
+                    for entries, keys, diff, delta in ((old_tt, old_keys, removed, -1), (normalized_tt, new_keys, added, 1)):
+                        if not diff:
+                            continue
+                        for e, k in zip(entries, keys):
+                            if diff[k] > 0:
+                                diff[k] -= 1
+                                TimetableGenerator.index_entry(indices, e, delta)
+                    # Re-check every cell whose entry sequence changed, including pure reorders,
+                    # so subject order matches what a full detection would report
+                    old_cells = TimetableGenerator.cell_key_sequences(old_tt, old_keys)
+                    new_cells = TimetableGenerator.cell_key_sequences(normalized_tt, new_keys)
+                    touched = {cell for cell, seq in new_cells.items() if old_cells.get(cell) != seq}
+                    touched.update(cell for cell in old_cells if cell not in new_cells)
+                    for day, slot in touched:
+                        found = TimetableGenerator.conflicts_at(day, slot, by_slot.get((day, slot), ()), indices)
+                        if found:
+                            slot_conflicts[(day, slot)] = found
+                        else:
+                            slot_conflicts.pop((day, slot), None)
+                stored['timetable'] = normalized_tt
+                stored['by_slot'] = by_slot
+                conflicts = [c for key in by_slot for c in slot_conflicts.get(key, [])]
+                stored['conflicts'] = conflicts
 
             # Apply memory updates if provided
             if session_id in session_memory and isinstance(mem_updates, dict):
@@ -477,7 +910,7 @@ def update_timetable():
             
             return jsonify({
                 'success': True,
-                'conflicts': generator.conflicts,
+                'conflicts': conflicts,
                 'memory': session_memory.get(session_id)
             })
         
@@ -489,126 +922,243 @@ def update_timetable():
 @app.route('/export/excel/<session_id>')
 def export_excel(session_id):
     try:
-        if session_id not in timetables:
+        stored = timetables.get(session_id)
+        if stored is None:
             return "Timetable not found", 404
         
-        timetable_data = timetables[session_id]['timetable']
-        metadata = timetables[session_id]['metadata']
+        metadata = stored['metadata']
+        timetable_data, by_slot, _conflicts = session_snapshot(stored)
+
+        # Serve the previous build if the timetable hasn't changed since
+        fingerprint = timetable_fingerprint(timetable_data)
+        cached = export_cache.get((session_id, 'excel'))
+        if cached is not None and cached[0] == fingerprint:
+            return send_export(cached[1], 'xlsx')
         
-        # Create workbook
-        wb = Workbook()
-        wb.remove(wb.active)
+        # Create workbook (write-only: rows are streamed out instead of kept as cell objects)
+        wb = Workbook(write_only=True)
         
         classrooms = metadata['classrooms']
         days = metadata['days']
         time_slots = metadata['time_slots']
         
-        # Define styles
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=11)
-        day_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-        day_font = Font(bold=True, size=10)
-        break_fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
-        break_font = Font(bold=True, color="856404", size=10)
-        class_fill = PatternFill(start_color="E7F3E7", end_color="E7F3E7", fill_type="solid")
-        title_font = Font(bold=True, size=14, color="4472C4")
-        
+        # Define styles once and register them as named styles shared by every cell
         thin_border = Border(
             left=Side(style='thin'),
             right=Side(style='thin'),
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
+        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        header_font = Font(bold=True, color="FFFFFF", size=11)
+        center = Alignment(horizontal='center', vertical='center')
+        center_wrap = Alignment(horizontal='center', vertical='center', wrap_text=True)
+        for named in (
+            NamedStyle(name='tt_title', font=Font(bold=True, size=14, color="4472C4"), alignment=center),
+            NamedStyle(name='tt_corner', fill=header_fill, font=header_font, alignment=center, border=thin_border),
+            NamedStyle(name='tt_header', fill=header_fill, font=header_font, alignment=center_wrap, border=thin_border),
+            NamedStyle(name='tt_day',
+                       fill=PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid"),
+                       font=Font(bold=True, size=10), alignment=center, border=thin_border),
+            NamedStyle(name='tt_entry',
+                       fill=PatternFill(start_color="E7F3E7", end_color="E7F3E7", fill_type="solid"),
+                       font=Font(size=9), alignment=center_wrap, border=thin_border),
+            NamedStyle(name='tt_empty', alignment=center_wrap, border=thin_border),
+        ):
+            wb.add_named_style(named)
         
         # Create a single sheet combining all classrooms
         ws = wb.create_sheet(title='Unified Timetable')
 
+        def styled(value, style):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            return cell
+
+        # Dimensions must be set before rows are streamed
+        ws.column_dimensions['A'].width = 15
+        for col in range(2, len(time_slots) + 2):
+            ws.column_dimensions[get_column_letter(col)].width = 28
+
+        ws.row_dimensions[1].height = 25
+        ws.row_dimensions[2].height = 30
+        for row in range(3, len(days) + 3):
+            ws.row_dimensions[row].height = 90
+
         # Title
-        ws['A1'] = 'Unified Weekly Timetable'
-        ws['A1'].font = title_font
         # Columns: Day + for each time slot, one column containing concatenated classroom entries
         total_cols = 1 + len(time_slots)
-        ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=total_cols)
-        ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
+        ws.merged_cells.add(f"A1:{get_column_letter(total_cols)}1")
+        ws.append([styled('Unified Weekly Timetable', 'tt_title')])
 
         # Column headers (time slots)
-        ws['A2'] = 'Day / Time'
-        ws['A2'].fill = header_fill
-        ws['A2'].font = header_font
-        ws['A2'].alignment = Alignment(horizontal='center', vertical='center')
-        ws['A2'].border = thin_border
-
-        for col, slot in enumerate(time_slots, start=2):
-            cell = ws.cell(row=2, column=col)
-            cell.value = slot
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.border = thin_border
+        ws.append([styled('Day / Time', 'tt_corner')] + [styled(slot, 'tt_header') for slot in time_slots])
 
         # Fill data: for each day and slot, list all classroom entries combined
-        for row, day in enumerate(days, start=3):
-            day_cell = ws.cell(row=row, column=1)
-            day_cell.value = day
-            day_cell.fill = day_fill
-            day_cell.font = day_font
-            day_cell.alignment = Alignment(horizontal='center', vertical='center')
-            day_cell.border = thin_border
-
-            for col, slot in enumerate(time_slots, start=2):
+        for day in days:
+            row = [styled(day, 'tt_day')]
+            for slot in time_slots:
                 # Collect entries for all classrooms at this day/slot
-                entries = [
-                    e for e in timetable_data
-                    if e['day'] == day and e['time_slot'] == slot
-                ]
-                cell = ws.cell(row=row, column=col)
+                entries = by_slot.get((day, slot), [])
                 if entries:
                     # Compose multiline text: Classroom(s): Subject (Semester) - Teacher
-                    formatted_blocks = []
-                    for e in entries:
-                        cls_list = e.get('classrooms') or []
-                        classroom_label = ', '.join(cls_list) if cls_list else '-'
-                        block = f"{classroom_label}: {e['subject']}\n{e['teacher']} ({e.get('semester', '-')})"
-                        if e.get('department_codes'):
-                            block += f"\nDept: {', '.join(e.get('department_codes') or [])}"
-                        if e.get('description'):
-                            block += f"\n{e.get('description')}"
-                        formatted_blocks.append(block)
-                    cell.value = "\n\n".join(formatted_blocks)
-                    cell.fill = class_fill
-                    cell.font = Font(size=9)
+                    row.append(styled("\n\n".join(format_entry_block(e) for e in entries), 'tt_entry'))
                 else:
-                    cell.value = ""
-                cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                cell.border = thin_border
-
-        # Adjust dimensions
-        ws.column_dimensions['A'].width = 15
-        for col in range(2, len(time_slots) + 2):
-            ws.column_dimensions[get_column_letter(col)].width = 28
-
-        ws.row_dimensions[1].height = 25
-        ws.row_dimensions[2].height = 30
-        for row in range(3, len(days) + 3):
-            ws.row_dimensions[row].height = 90
+                    row.append(styled("", 'tt_empty'))
+            ws.append(row)
         
         # Save to BytesIO
         output = io.BytesIO()
         wb.save(output)
-        output.seek(0)
+        data = output.getvalue()
+        export_cache[(session_id, 'excel')] = (fingerprint, data)
         
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'timetable_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        )
+        return send_export(data, 'xlsx')
         
     except Exception as e:
         import traceback
         traceback.print_exc()
         return str(e), 500
 
+EXPORT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+}
+
+def session_snapshot(stored):
+    """(timetable, by_slot, conflicts) of a stored session, read together under its lock so an
+    export never pairs one edit's timetable with another's slot index"""
+    with stored['lock']:
+        timetable_data = stored['timetable']
+        by_slot = stored.get('by_slot') or TimetableGenerator.group_by_slot(timetable_data)
+        return timetable_data, by_slot, stored.get('conflicts', [])
+
+def timetable_fingerprint(timetable_data):
+    """Cheap content hash of a timetable, used to validate cached exports"""
+    return hash(tuple(
+        (e.day, e.time_slot, e.subject, e.teacher, e.semester,
+         tuple(e.classrooms), tuple(e.department_codes), e.description)
+        for e in timetable_data
+    ))
+
+def format_entry_block(e, esc=str, newline="\n"):
+    """Multiline cell text for one entry: classrooms/subject, teacher/semester, then optional dept and description"""
+    classroom_label = esc(', '.join(e.classrooms)) if e.classrooms else '-'
+    dept = f"{newline}Dept: {esc(', '.join(e.department_codes))}" if e.department_codes else ''
+    desc = f"{newline}{esc(e.description)}" if e.description else ''
+    return f"{classroom_label}: {esc(e.subject)}{newline}{esc(e.teacher)} ({esc(e.semester)}){dept}{desc}"
+
+# Paragraph-markup escapes of entry field values; the same teachers/subjects fill many cells
+escaped_fields = {}
+
+def escape_field(value):
+    value = str(value)
+    escaped = escaped_fields.get(value)
+    if escaped is None:
+        if len(escaped_fields) >= 10000:
+            escaped_fields.clear()
+        escaped = escaped_fields[value] = escape(value).replace('\n', '<br/>')
+    return escaped
+
+def pdf_cell_flowables(entries, style):
+    """One Paragraph per entry with a thin rule between them, so ReportLab wraps each block on its own"""
+    cell = []
+    for e in entries:
+        if cell:
+            cell.append(HRFlowable(width='100%', thickness=0.3, color=ENTRY_SEP_COLOR, spaceBefore=3, spaceAfter=3))
+        cell.append(Paragraph(format_entry_block(e, esc=escape_field, newline='<br/>'), style))
+    return cell
+
+# Static parts of the PDF table styles; per-request code only appends row/cell dependent commands
+HEADER_BG = colors.Color(0.18, 0.36, 0.6)
+HEADER_TEXT = colors.whitesmoke
+DAY_COL_BG = colors.HexColor('#E9EFF8')
+DAY_TEXT_COLOR = colors.HexColor('#0F3057')
+GRID_COLOR = colors.HexColor('#B0BEC5')
+ZEBRA_BG = colors.HexColor('#F7FAFC')
+ENTRY_SEP_COLOR = colors.HexColor('#DDE6F3')
+# Background of cells that hold at least one entry
+HIGHLIGHT_BG = colors.HexColor('#E8F5E9')
+
+# Paragraph styles are read-only once built, so every export shares one stylesheet
+_STYLES = getSampleStyleSheet()
+# Entry text inside timetable cells; matches the plain cell font set in BASE_TIMETABLE_STYLE
+ENTRY_STYLE = ParagraphStyle('TimetableEntry', parent=_STYLES['BodyText'], fontName='Helvetica',
+                             fontSize=9, leading=11, alignment=TA_CENTER)
+
+BASE_TIMETABLE_STYLE = (
+    ('BACKGROUND', (0, 0), (-1, 0), HEADER_BG),
+    ('TEXTCOLOR', (0, 0), (-1, 0), HEADER_TEXT),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+    ('TOPPADDING', (0, 0), (-1, 0), 10),
+    ('BACKGROUND', (0, 1), (0, -1), DAY_COL_BG),
+    ('TEXTCOLOR', (0, 1), (0, -1), DAY_TEXT_COLOR),
+    ('FONTNAME', (0, 1), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 1), (0, -1), 10),
+    ('FONTNAME', (1, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (1, 1), (-1, -1), 9),
+    ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('LEFTPADDING', (0, 0), (-1, -1), 6),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('GRID', (0, 0), (-1, -1), 0.5, GRID_COLOR),
+    # Zebra striping for rows (excluding header and day column)
+    ('ROWBACKGROUNDS', (1, 1), (-1, -1), [colors.white, ZEBRA_BG]),
+)
+
+CONFLICTS_HEADERS = ['Type','Day','Time','Teacher','Classroom','Semester','Subjects','Suggestions']
+CONFLICTS_COL_WIDTHS = (80,60,60,110,110,90,200,200)
+CONFLICT_TYPE_LABELS = {'teacher':'Teacher','classroom':'Classroom','student':'Student'}
+
+CONFLICTS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), HEADER_BG),
+    ('TEXTCOLOR', (0,0), (-1,0), HEADER_TEXT),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+    ('GRID', (0,0), (-1,-1), 0.5, GRID_COLOR),
+    ('FONTSIZE', (0,0), (-1,0), 11),
+    ('FONTSIZE', (0,1), (-1,-1), 8),
+    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+    ('LEFTPADDING', (0, 0), (-1, -1), 6),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+])
+
+# PDFs up to this size are built in memory; larger ones spill to a temp file while being built
+PDF_SPOOL_MAX_SIZE = 1 << 20
+
+def send_export(data, extension):
+    """Download response for export bytes, or for a binary file positioned at its start"""
+    download_name = f'timetable_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    if isinstance(data, bytes):
+        # Hand the bytes over as one body chunk with a known length rather than
+        # wrapping them in a file that gets re-read in small blocks
+        return Response(data, mimetype=EXPORT_MIMETYPES[extension],
+                        headers={'Content-Disposition': f'attachment; filename={download_name}',
+                                 'Cache-Control': 'no-cache'})
+    # Real files go through send_file so the WSGI server's file_wrapper (sendfile under gunicorn) is used
+    return send_file(
+        data,
+        mimetype=EXPORT_MIMETYPES[extension],
+        as_attachment=True,
+        download_name=download_name
+    )
+
+def pdf_content_key(metadata, timetable_data, conflicts):
+    """blake2b digest of everything the PDF renders; Entry and conflict reprs are deterministic"""
+    payload = repr((metadata['days'], metadata['time_slots'], timetable_data, conflicts))
+    return blake2b(payload.encode(), digest_size=16).digest()
+
+def invalidate_exports(session_id):
+    # PDFs are cached by content, so only the per-session Excel build goes stale
+    export_cache.pop((session_id, 'excel'), None)
+
 # Memory utility endpoints for frontend integration
 @app.route('/memory/<session_id>', methods=['GET'])
 def get_memory(session_id):
@@ -618,7 +1168,7 @@ def get_memory(session_id):
 
 @app.route('/memory/<session_id>', methods=['POST'])
 def update_memory(session_id):
-    data = request.json or {}
+    data = request.get_json(cache=False) or {}
     if session_id not in session_memory:
         session_memory[session_id] = {}
     session_memory[session_id].update({k: v for k, v in data.items() if v is not None})
@@ -634,16 +1184,25 @@ def clear_memory(session_id):
 
 @app.route('/export/pdf/<session_id>')
 def export_pdf(session_id):
+    stored = timetables.get(session_id)
+    if stored is None:
+        return "Timetable not found", 404
+
+    metadata = stored['metadata']
+    if not metadata.get('days') or not metadata.get('time_slots'):
+        return "Timetable has no days or time slots to export", 400
+    # The cache key and the rendered cells must come from the same edit
+    timetable_data, by_slot, conflicts = session_snapshot(stored)
+
+    # Serve an earlier build of identical content, from this session or any other
+    content_key = pdf_content_key(metadata, timetable_data, conflicts)
+    cached = pdf_cache.get(content_key)
+    if cached is not None:
+        return send_export(cached, 'pdf')
+
     try:
-        if session_id not in timetables:
-            return "Timetable not found", 404
-        
-        timetable_data = timetables[session_id]['timetable']
-        metadata = timetables[session_id]['metadata']
-        conflicts = timetables[session_id].get('conflicts', [])
-        
-        # Create PDF
-        output = io.BytesIO()
+        # Create PDF; large documents spill to a temp file instead of staying in memory
+        output = SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE, mode='w+b')
         doc = SimpleDocTemplate(
             output, 
             pagesize=landscape(A3), 
@@ -654,7 +1213,7 @@ def export_pdf(session_id):
         )
         elements = []
         
-        styles = getSampleStyleSheet()
+        styles = _STYLES
         classrooms = metadata['classrooms']
         days = metadata['days']
         time_slots = metadata['time_slots']
@@ -665,33 +1224,10 @@ def export_pdf(session_id):
         elements.append(Spacer(1, 0.2 * inch))
 
         # Create table data: Day/Time + for each slot, one cell containing combined entries for all classrooms
-        table_data = [['Day / Time'] + time_slots]
-
-        for day in days:
-            row = [day]
-            for slot in time_slots:
-                entries = [e for e in timetable_data if e['day'] == day and e['time_slot'] == slot]
-                if entries:
-                    # Build visually separated entries using themed bullet separators
-                    themed_sep = " \u2022 "  # bullet dot separator
-                    formatted = []
-                    for e in entries:
-                        cls_list = e.get('classrooms') or []
-                        classroom_label = ', '.join(cls_list) if cls_list else '-'
-                        block_lines = [
-                            f"{classroom_label}: {e['subject']}",
-                            f"{e['teacher']} ({e.get('semester', '-')})"
-                        ]
-                        if e.get('department_codes'):
-                            block_lines.append(f"Dept: {', '.join(e.get('department_codes') or [])}")
-                        if e.get('description'):
-                            block_lines.append(e['description'])
-                        formatted.append("\n".join(block_lines))
-                    # Join blocks with a clear separator line and extra spacing for readability
-                    row.append((f"\n{themed_sep}\n").join(formatted))
-                else:
-                    row.append('')
-            table_data.append(row)
+        table_data = [['Day / Time'] + time_slots] + [
+            [day] + [pdf_cell_flowables(by_slot.get((day, slot), ()), ENTRY_STYLE) for slot in time_slots]
+            for day in days
+        ]
 
         # Compute column widths to span full page width
         available_width = doc.width
@@ -704,56 +1240,21 @@ def export_pdf(session_id):
         # Create and style table with enhanced design
         table = Table(table_data, repeatRows=1, colWidths=col_widths)
 
-        header_bg = colors.Color(0.18, 0.36, 0.6)
-        header_text = colors.whitesmoke
-        day_col_bg = colors.HexColor('#E9EFF8')
-        grid_color = colors.HexColor('#B0BEC5')
-        zebra_bg = colors.HexColor('#F7FAFC')
-        entry_sep_color = colors.HexColor('#DDE6F3')
-
-        style_list = [
-            ('BACKGROUND', (0, 0), (-1, 0), header_bg),
-            ('TEXTCOLOR', (0, 0), (-1, 0), header_text),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-            ('TOPPADDING', (0, 0), (-1, 0), 10),
-            ('BACKGROUND', (0, 1), (0, -1), day_col_bg),
-            ('TEXTCOLOR', (0, 1), (0, -1), colors.HexColor('#0F3057')),
-            ('FONTNAME', (0, 1), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 1), (0, -1), 10),
-            ('FONTNAME', (1, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (1, 1), (-1, -1), 9),
-            ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('GRID', (0, 0), (-1, -1), 0.5, grid_color),
-        ]
+        style_list = list(BASE_TIMETABLE_STYLE)
 
-        # Zebra striping for rows (excluding header)
-        for r in range(1, len(table_data)):
-            if r % 2 == 0:
-                style_list.append(('BACKGROUND', (1, r), (-1, r), zebra_bg))
+        # Table (col, row) of each (day, slot), so cells can be styled straight from the slot index
+        cell_pos = {
+            (day, slot): (c, r)
+            for r, day in enumerate(days, start=1)
+            for c, slot in enumerate(time_slots, start=1)
+        }
 
         # Per-cell subject color is not trivial in a combined multi-entry cell; keep readable base and subtle highlight if any entries exist
-        for row_idx, day in enumerate(days, start=1):
-            for col_idx, slot in enumerate(time_slots, start=1):
-                has_any = any(e for e in timetable_data if e['day'] == day and e['time_slot'] == slot)
-                if has_any:
-                    style_list.append(('BACKGROUND', (col_idx, row_idx), (col_idx, row_idx), colors.HexColor('#E8F5E9')))
-
-        # Add subtle inner separators inside cells that have multiple entries
-        for r, day in enumerate(days, start=1):
-            for c, slot in enumerate(time_slots, start=1):
-                es = [e for e in timetable_data if e['day'] == day and e['time_slot'] == slot]
-                if len(es) > 1:
-                    # Slight background tint to highlight multi-entry cells already set above; keep additional separator borders light
-                    style_list.append(('LINEBEFORE', (c, r), (c, r), 0, entry_sep_color))
-                    style_list.append(('LINEAFTER', (c, r), (c, r), 0, entry_sep_color))
+        for key, es in by_slot.items():
+            pos = cell_pos.get(key)
+            if es and pos is not None:
+                style_list.append(('BACKGROUND', pos, pos, HIGHLIGHT_BG))
+
         table.setStyle(TableStyle(style_list))
         elements.append(table)
 
@@ -763,63 +1264,74 @@ def export_pdf(session_id):
             elements.append(Paragraph("<b>Conflicts</b>", styles['Title']))
             elements.append(Spacer(1, 0.2*inch))
 
-            conflict_headers = ['Type','Day','Time','Teacher','Classroom','Semester','Subjects','Suggestions']
-            conflict_rows = [conflict_headers]
-            type_map = {'teacher':'Teacher','classroom':'Classroom','student':'Student'}
-
-            for c in conflicts:
-                conflict_rows.append([
-                    type_map.get(c.get('type'), 'Conflict'),
-                    c.get('day','-') or '-',
-                    c.get('time_slot','-') or '-',
-                    c.get('teacher','-') or '-',
-                    c.get('classroom','-') or '-',
-                    c.get('semester','-') or '-',
-                    ", ".join(c.get('subjects', []) or []),
-                    ", ".join(c.get('suggestions', []) or [])
-                ])
-            conflicts_table = Table(conflict_rows, repeatRows=1, colWidths=[80,60,60,110,110,90,200,200])
-            conflicts_table.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), header_bg),
-                ('TEXTCOLOR', (0,0), (-1,0), header_text),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-                ('GRID', (0,0), (-1,-1), 0.5, grid_color),
-                ('FONTSIZE', (0,0), (-1,0), 11),
-                ('FONTSIZE', (0,1), (-1,-1), 8),
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                ('LEFTPADDING', (0, 0), (-1, -1), 6),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-                ('TOPPADDING', (0, 0), (-1, -1), 4),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-            ]))
+            tmap = CONFLICT_TYPE_LABELS.get
+            conflict_rows = [CONFLICTS_HEADERS] + [
+                [
+                    tmap(c.get('type'), 'Conflict'),
+                    c.get('day') or '-',
+                    c.get('time_slot') or '-',
+                    c.get('teacher') or '-',
+                    c.get('classroom') or '-',
+                    c.get('semester') or '-',
+                    ", ".join(c.get('subjects') or ()),
+                    ", ".join(c.get('suggestions') or ())
+                ]
+                for c in conflicts
+            ]
+            conflicts_table = Table(conflict_rows, repeatRows=1, colWidths=CONFLICTS_COL_WIDTHS)
+            conflicts_table.setStyle(CONFLICTS_TABLE_STYLE)
             elements.append(conflicts_table)
         
         doc.build(elements)
+        if output.tell() > PDF_CACHE_MAX_ENTRY_BYTES:
+            # Too big to keep around: stream it from the spooled file and skip the cache
+            output.seek(0)
+            return send_export(output, 'pdf')
+        # Read back even builds that spilled to disk; large ones are the most expensive to redo
         output.seek(0)
+        data = output.read()
+        output.close()
+        pdf_cache[content_key] = data
         
-        return send_file(
-            output,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'timetable_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-        )
+        return send_export(data, 'pdf')
         
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
+    except (LayoutError, KeyError, ValueError) as e:
+        app.logger.exception("PDF export failed for session %s", session_id)
         return str(e), 500
 
+# Conflict responses smaller than this aren't worth compressing
+GZIP_MIN_SIZE = 1024
+
 @app.route('/conflicts/<session_id>', methods=['GET'])
 def get_conflicts(session_id):
-    if session_id not in timetables:
+    stored = timetables.get(session_id)
+    if stored is None:
         return jsonify({'error': 'Session not found'}), 404
-    return jsonify({'success': True, 'conflicts': timetables[session_id].get('conflicts', [])})
+    # Serialize (and gzip) once per conflict set. The bodies are tied to the list they were built
+    # from; /update-timetable stores a new list, so a stale body can never be served for it.
+    conflicts = stored.get('conflicts', [])
+    cached = stored.get('conflicts_bodies')
+    if cached is not None and cached[0] is conflicts:
+        bodies = cached[1]
+    else:
+        bodies = {
+            'identity': app.json.dumps({'success': True, 'conflicts': conflicts},
+                                       separators=(',', ':')).encode() + b'\n'
+        }
+        stored['conflicts_bodies'] = (conflicts, bodies)
+    body = bodies['identity']
+    use_gzip = len(body) >= GZIP_MIN_SIZE and request.accept_encodings['gzip'] > 0
+    if use_gzip:
+        body = bodies.get('gzip') or bodies.setdefault('gzip', gzip.compress(body, compresslevel=6))
+    response = Response(body, mimetype='application/json')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 if __name__ == "__main__":
-    # Remove debug=True and port
+    # Local runs only; production serves app:app through gunicorn (see Procfile)
     # Railway sets port automatically via $PORT environment variable
-    import os
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+    app.run(host="0.0.0.0", port=port, debug=os.environ.get("FLASK_DEBUG") == "1")
 